@@ -1,16 +1,168 @@
-from asyncio import Future, IncompleteReadError, LimitOverrunError, StreamReader, StreamReaderProtocol, StreamWriter, Task
+from asyncio import BufferedProtocol, Future, IncompleteReadError, LimitOverrunError, Task, Transport
 import asyncio
+from collections import deque
 from dataclasses import dataclass
 import json
-from os import system
-from typing import Any, Generator, List, MutableMapping, Optional, Sequence
+import re
+import sys
+from typing import Any, Deque, Iterator, List, Optional, Sequence, Tuple, Union
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    def _loads(data: Union[bytes, bytearray, memoryview]) -> Any:
+        # json.loads does not take memoryviews
+        return json.loads(bytes(data))
 
-class JsonStreamReader(StreamReader):
+# Json insignificant whitespace
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_WHITESPACE_BYTES = b' \t\n\r'
+
+# Placeholder for an object that was framed by scanning and has not been decoded yet
+_NOT_DECODED = object()
+
+# Bytes that change nesting or string state outside of strings, and the bytes that matter inside them
+_STRUCTURE = re.compile(rb'[\[\]{}"]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+# str.translate table removing '[' and ']' from spu language names
+_STRIP_BRACKETS = str.maketrans('', '', '[]')
+
+
+def _scan_json(buffer: bytearray, pos: int, end: int, depth: int, in_string: bool) -> Tuple[int, int, bool]:
+    """Scan buffer[pos:end] for the end of a json object or array, without parsing it.
+
+    Resumes from a previous (pos, depth, in_string) state and returns the new one. A depth
+    of 0 means the value is complete and ends just before pos. The regexes let the re module
+    skip over numbers and string contents, so only structural bytes are looked at in python.
+    """
+    while True:
+        if in_string:
+            match = _STRING_SPECIAL.search(buffer, pos, end)
+            if match is None:
+                return end, depth, True
+            pos = match.end()
+            if buffer[pos - 1] == 0x5c:
+                # Backslash escapes the next byte; come back later if it has not arrived yet
+                if pos == end:
+                    return pos - 1, depth, True
+                pos += 1
+            else:
+                in_string = False
+        else:
+            match = _STRUCTURE.search(buffer, pos, end)
+            if match is None:
+                return end, depth, False
+            pos = match.end()
+            byte = buffer[pos - 1]
+            if byte == 0x22:
+                in_string = True
+            elif byte == 0x7b or byte == 0x5b:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos, 0, False
+
+
+class JsonBufferedProtocol(BufferedProtocol):
+    """Receives straight into a reusable bytearray and hands out complete json objects.
+
+    Unread data lives in _buffer[_start:_end]; the space after _end is handed to the
+    transport by get_buffer so the socket can recv_into it without intermediate copies.
+    How far the object at _start has been scanned is kept relative to _start, so it
+    survives compaction.
+    """
     _exception: Optional[Exception]
     _buffer: bytearray
+    _start: int
+    _end: int
     _eof: bool
     _limit: int
+    _paused: bool
+    _waiter: Optional[Future[None]]
+    _transport: Optional[Transport]
+    _scanned: int
+    _depth: int
+    _in_string: bool
+
+    def __init__(self, limit: int = 65536):
+        self._exception = None
+        self._buffer = bytearray(limit)
+        self._start = 0
+        self._end = 0
+        self._eof = False
+        self._limit = limit
+        self._paused = False
+        self._waiter = None
+        self._transport = None
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+    def connection_made(self, transport: Transport) -> None: # type: ignore[override]
+        self._transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if exc is not None:
+            self._exception = exc
+        self._eof = True
+        self._wakeup_waiter()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        # sizehint is -1 when the transport has no preference
+        needed = max(sizehint, 4096)
+        if len(self._buffer) - self._end < needed:
+            if self._start > len(self._buffer) // 2:
+                # Move the unread data to the front to reclaim consumed space. Only done once
+                # more than half the buffer is consumed, so the move is always the smaller part.
+                unread = self._end - self._start
+                self._buffer[:unread] = self._buffer[self._start:self._end]
+                self._start = 0
+                self._end = unread
+            free = len(self._buffer) - self._end
+            if free < needed:
+                self._buffer.extend(bytes(max(needed - free, len(self._buffer))))
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._end += nbytes
+        if (
+            self._transport is not None
+            and not self._paused
+            and self._end - self._start > 2 * self._limit
+        ):
+            self._paused = True
+            self._transport.pause_reading()
+        self._wakeup_waiter()
+
+    def eof_received(self) -> None:
+        self._eof = True
+        self._wakeup_waiter()
+
+    def _wakeup_waiter(self) -> None:
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _maybe_resume_transport(self) -> None:
+        if self._paused and self._end - self._start <= self._limit:
+            self._paused = False
+            assert self._transport is not None
+            self._transport.resume_reading()
+
+    async def _wait_for_data(self) -> None:
+        if self._paused:
+            self._paused = False
+            assert self._transport is not None
+            self._transport.resume_reading()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
 
     async def readjson(self) -> Any:
         """Read data from the stream until a complete json object is assembled.
@@ -23,78 +175,130 @@ class JsonStreamReader(StreamReader):
         LimitOverrunError exception  will be raised, and the data
         will be left in the internal buffer, so it can be read again.
         """
-        if self._exception is not None:
-            raise self._exception
+        sep, obj = await self._wait_for_object()
+        try:
+            if obj is _NOT_DECODED:
+                with memoryview(self._buffer) as view:
+                    obj = _loads(view[self._start:self._start + sep])
+            return obj
+        finally:
+            self._consume(sep)
 
-        obj = None
+    async def _wait_for_object(self) -> Tuple[int, Any]:
+        """Wait until a complete json object starts at _start, returning its length and the object.
 
+        The object is _NOT_DECODED unless it could be decoded in one go.
+        """
         while True:
-            # Skip initial whitespaces
-            while len(self._buffer) != 0 and self._buffer[0:1].isspace():
-                del self._buffer[0]
-
-            if len(self._buffer) > 0:
-                first = self._buffer[0:1]
-                assert first in (b'{', b'['), f"Stream contains non-json-start: {first} - {bytes(self._buffer)}"
+            if self._exception is not None:
+                raise self._exception
 
-                try:
-                    obj = json.loads(self._buffer)
-                    sep = len(self._buffer)-1
+            # Skip initial whitespaces
+            buffer = self._buffer
+            end = self._end
+            start = self._start = _WHITESPACE.match(buffer, self._start, end).end()
+
+            if start != end:
+                first = buffer[start:start + 1]
+                assert first in (b'{', b'['), \
+                    f"Stream contains non-json-start: {first} - {bytes(buffer[start:end])}"
+
+                # Replies are answered one at a time, so the buffer usually holds exactly one
+                # complete object. When it looks like it does, let _loads parse it in one go.
+                stop = end
+                while buffer[stop - 1] in _WHITESPACE_BYTES:
+                    stop -= 1
+                if buffer[stop - 1] in b'}]':
+                    with memoryview(buffer) as view:
+                        try:
+                            obj = _loads(view[start:stop])
+                        except ValueError:
+                            # Incomplete, or followed by another object
+                            pass
+                        else:
+                            sep = stop - start
+                            self._scanned = self._depth = 0
+                            self._in_string = False
+                            break
+
+                stop, self._depth, self._in_string = _scan_json(
+                    buffer, start + self._scanned, end, self._depth, self._in_string)
+                self._scanned = stop - start
+                if self._depth == 0:
+                    sep = self._scanned
+                    self._scanned = 0
+                    obj = _NOT_DECODED
                     break
-                except json.JSONDecodeError as e:
-                    if e.msg == 'Extra data':
-                        sep = e.pos
-                        break
 
             # Complete message (with full separator) may be present in buffer
             # even when EOF flag is set. This may happen when the last chunk
             # adds data which makes separator be found. That's why we check for
             # EOF *ater* inspecting the buffer.
             if self._eof:
-                chunk = bytes(self._buffer)
-                self._buffer.clear()
+                with memoryview(self._buffer) as view:
+                    chunk = bytes(view[self._start:self._end])
+                self._start = self._end = 0
+                self._scanned = self._depth = 0
+                self._in_string = False
                 raise IncompleteReadError(chunk, None)
 
             # _wait_for_data() will resume reading if stream was paused.
-            await self._wait_for_data('readjson') # type: ignore
+            await self._wait_for_data()
 
         if sep > self._limit:
             raise LimitOverrunError(
                 'Object found, but chunk is longer than limit', sep)
+        return sep, obj
 
-        chunk = self._buffer[:sep]
-        del self._buffer[:sep]
-        if obj is None:
-            obj = json.loads(chunk)
-        self._maybe_resume_transport() # type: ignore
-        return obj
+    def _consume(self, sep: int) -> None:
+        self._start += sep
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buffer) > self._limit:
+                # Grown for a burst of data; don't hold on to the peak size for the rest of the connection.
+                # A fresh bytearray also sidesteps resizing one that a transport may still have a view of.
+                self._buffer = bytearray(self._limit)
+        self._maybe_resume_transport()
 
 
 @dataclass
 class SpuEntry:
+    __slots__ = ('index', 'language', 'description')
+
     index : int
     language: str
     description: str
 
 SpuList = Sequence[SpuEntry]
 
+def _parse_spu_entry(index: int, text: str) -> SpuEntry:
+    """Turn a spu-es choice like 'Track 1 - [English]' into an entry"""
+    description, separator, language = text.partition(" - ")
+    language = language.translate(_STRIP_BRACKETS) if separator else 'none'
+    return SpuEntry(index, language, description)
+
 @dataclass
 class Request:
+    __slots__ = ('request_id', 'request_code', 'request_reply', 'completed')
+
     request_id : int
     request_code : str
     request_reply : Any
     completed: Future['Request']
 
+    def buffers(self) -> Tuple[bytes, bytes]:
+        """The framed request as (header, code), suitable for a gathering write"""
+        code = self.request_code.encode('utf8')
+        request_id = b"%d:" % self.request_id
+        return b"%d:%b" % (len(request_id) + len(code), request_id), code
+
     def bytes(self) -> bytes:
-        message = f"{self.request_id}:{self.request_code}"
-        msg_length = len(message)
-        full_message = f"{msg_length}:{message}"
-        return full_message.encode('utf8')
+        return b"".join(self.buffers())
 
 
 class VLCApi:
-    reader : JsonStreamReader
-    writer : StreamWriter
+    reader : JsonBufferedProtocol
+    writer : Transport
 
     running: bool
 
@@ -102,27 +306,32 @@ class VLCApi:
 
     request_count: int
 
-    current_requests: MutableMapping[int, Request]
+    # In-flight requests indexed by request_id - _request_base. Ids are handed out
+    # consecutively, so this window only ever grows at the right and shrinks from the left.
+    _request_base: int
+    _request_slots: Deque[Optional[Request]]
 
     read_exception: Optional[Exception]
 
+    # Request frames waiting to be written together at the next loop iteration
+    _pending_writes: List[bytes]
+
     shutdown: Future[None]
 
     def __init__(self):
         self.request_count = 0
         self.running = False
-        self.current_requests = dict()
+        self._request_base = 0
+        self._request_slots = deque()
         self.read_exception = None
+        self._pending_writes = []
     
     async def _open_connection(self, host: str, port: int, limit: int = 65536):
-        """asyncio.open_connection says to copy-paste-modify to change reader classes"""
+        """Connect with a JsonBufferedProtocol; the transport itself serves as the writer"""
         loop = asyncio.get_running_loop()
-        reader = JsonStreamReader(limit=limit, loop=loop)
-        protocol = StreamReaderProtocol(reader, loop=loop)
-        transport, _ = await loop.create_connection(
-            lambda: protocol, host, port)
-        writer = StreamWriter(transport, protocol, reader, loop)
-        return reader, writer
+        transport, protocol = await loop.create_connection(
+            lambda: JsonBufferedProtocol(limit=limit), host, port)
+        return protocol, transport
     
     async def connect(self, host: str, port: int, wait_until_started: bool=False):
         assert self.running == False
@@ -134,7 +343,15 @@ class VLCApi:
                 await __connect()
             except ConnectionRefusedError:
                 print("vlc not available, waiting for signal that it has started")
-                system("waitfor VlcStarted")
+                waiter = await asyncio.create_subprocess_exec(
+                    "waitfor", "VlcStarted",
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+                try:
+                    await waiter.wait()
+                finally:
+                    # Don't leave waitfor running if the reconnect is cancelled
+                    if waiter.returncode is None:
+                        waiter.kill()
                 print("signal received that vlc has started")
                 await __connect()
 
@@ -159,7 +376,7 @@ class VLCApi:
                     #  callbacks etc
                     continue
 
-                request = self.current_requests.get(reply_id, None)
+                request = self._get_request(reply_id)
                 if not request:
                     # The request was dropped before it was answered?
                     continue
@@ -170,8 +387,8 @@ class VLCApi:
 
         except (RuntimeError, IncompleteReadError) as e:
             self.read_exception = e
-            for request in self.current_requests.values():
-                if not request.completed.cancelled():
+            for request in self._request_slots:
+                if request is not None and not request.completed.cancelled():
                     request.completed.cancel()
             raise
 
@@ -181,34 +398,72 @@ class VLCApi:
                 self.shutdown.cancel()
 
 
-    
+
+    def _flush_writes(self):
+        self.writer.writelines(self._pending_writes)
+        self._pending_writes.clear()
+
+    def _get_request(self, request_id: int) -> Optional[Request]:
+        slot = request_id - self._request_base
+        if 0 <= slot < len(self._request_slots):
+            return self._request_slots[slot]
+        return None
+
+    def _release_request(self, request_id: int):
+        slots = self._request_slots
+        slot = request_id - self._request_base
+        if not 0 <= slot < len(slots):
+            # Already released and dropped from the window
+            return
+        slots[slot] = None
+        # The window only shrinks from the left, so a request at the head that never completes
+        # keeps the released slots behind it around. Those hold None rather than the requests,
+        # so that costs a pointer per request until the head is released.
+        while slots and slots[0] is None:
+            slots.popleft()
+            self._request_base += 1
+
     async def test_connection(self) -> bool:
         res = await self.execute("return 2+2")
         return res['result'] == 4
     
     def issue_request(self, lua: str) -> Future[Request]:
+        request = self._submit(lua)
+
+        def cleanup(future: Future[Any]):
+            self._release_request(request.request_id)
+
+        request.completed.add_done_callback(cleanup)
+
+        return request.completed
+
+    def _submit(self, lua: str) -> Request:
+        """Register and send a request; the caller is responsible for releasing it"""
         if self.read_exception:
             raise self.read_exception
         
         req_id = self.request_count
         self.request_count += 1
 
-        request = Request(request_id=req_id, request_code=lua, request_reply=None, completed=asyncio.get_running_loop().create_future())
-        self.current_requests[req_id] = request
-
-        self.writer.write(request.bytes())
-
-        def cleanup(future: Future[Any]):
-            del self.current_requests[req_id]
+        request = Request(
+            request_id=req_id, request_code=lua, request_reply=None,
+            completed=asyncio.get_running_loop().create_future())
+        self._request_slots.append(request)
 
-        request.completed.add_done_callback(cleanup)
+        if not self._pending_writes:
+            asyncio.get_running_loop().call_soon(self._flush_writes)
+        self._pending_writes.extend(request.buffers())
 
-        return request.completed
+        return request
 
     
     async def execute(self, lua: str) -> Any:
 
-        reply = await self.issue_request(lua=lua)
+        request = self._submit(lua)
+        try:
+            reply = await request.completed
+        finally:
+            self._release_request(request.request_id)
 
         obj = reply.request_reply
 
@@ -220,18 +475,12 @@ class VLCApi:
         return obj
 
     
-    async def get_spu_entries(self) -> Generator[SpuEntry, None, None]:
+    async def get_spu_entries(self) -> Iterator[SpuEntry]:
         response = await self.execute('return {vlc.var.get_list(vlc.object.input(), "spu-es")}')
         indices: List[int]
         descriptions: List[str]
         indices, descriptions = response['result']
-        def work():
-            for index, text in zip(indices, descriptions):
-                a,b = (text.split(" - ", maxsplit=1) + ['none'])[0:2]
-                language = b.replace('[', '').replace(']', '')
-                description = a
-                yield SpuEntry(index=index, language=language, description=description)
-        return work()
+        return map(_parse_spu_entry, indices, descriptions)
 
     async def get_spu_list(self) -> SpuList:
         return list(await self.get_spu_entries())
@@ -259,7 +508,15 @@ async def run():
 
 
 def main():
-    asyncio.run(run())
+    # Prefer a libuv based event loop when one is installed
+    try:
+        if sys.platform == 'win32':
+            from winloop import run as run_loop
+        else:
+            from uvloop import run as run_loop
+    except ImportError:
+        run_loop = asyncio.run
+    run_loop(run())
 
 
 
@@ -147,6 +147,8 @@ local function check_running()
 end
 
 local clients = {}
+-- received bytes per client that do not yet make up a complete request
+local pending = {}
 
 local function is_set(num, bit_value)
     return (math.floor(num / bit_value) % 2) == 1
@@ -216,6 +218,7 @@ local function manage_connections(clients)
     end
     for _, client in ipairs(to_remove) do
         clients[client] = nil
+        pending[client] = nil
         vlc.net.close(client)
     end
     return readable
@@ -250,33 +253,54 @@ local function run()
             local str = vlc.net.recv(client, 10000)
             if not str then break end
 
-            str = string.gsub(str,"\r?\n$","")
-            log("GOT " .. str)
-
-            local _, _, msg_len, request_id, code = string.find(str, "^(.-):(.-):(.*)$")
-            msg_len, request_id = tonumber(msg_len), tonumber(request_id)
-            
-            local buffer
-            local res = evaluate_code(code, nil)
-            if res.error or res.timeout then
-                log("Failed to exec")
-                res.reply_id = request_id
-                res.result = NULL
-                buffer = pp(res)
-            else
-                log("Exec successfull")
-                if res.result == nil then res.result = NULL end
-                local res = execute_limited(function() return pp({timeout=false, reply_id=request_id, result=res.result}, { indent = true }) end, 10000)
-                if res.timeout then
-                    buffer = pp({timeout=true, error="Serialization of result took too long", reply_id=request_id})
+            -- One recv may hold several requests, or only part of one; split on the length prefix
+            local data = (pending[client] or "") .. str
+            while true do
+                data = string.gsub(data, "^%s+", "")
+                local _, header_end, msg_len = string.find(data, "^(%d+):")
+                if not msg_len then
+                    -- Anything but the start of a length prefix can never become a request;
+                    -- answer with an error and drop it so the connection keeps working
+                    if not string.find(data, "^%d*$") then
+                        log("Malformed request: " .. data)
+                        vlc.net.send(client, pp({timeout=false, result=NULL, error="Malformed request, expected <length>:<id>:<code>"}) .. "\n")
+                        data = ""
+                    end
+                    break
+                end
+                msg_len = tonumber(msg_len)
+                if #data < header_end + msg_len then break end
+
+                local message = string.sub(data, header_end + 1, header_end + msg_len)
+                data = string.sub(data, header_end + msg_len + 1)
+                log("GOT " .. message)
+
+                local _, _, request_id, code = string.find(message, "^(.-):(.*)$")
+                request_id = tonumber(request_id)
+
+                local buffer
+                local res = evaluate_code(code, nil)
+                if res.error or res.timeout then
+                    log("Failed to exec")
+                    res.reply_id = request_id
+                    res.result = NULL
+                    buffer = pp(res)
                 else
-                    buffer = res.result
+                    log("Exec successfull")
+                    if res.result == nil then res.result = NULL end
+                    local res = execute_limited(function() return pp({timeout=false, reply_id=request_id, result=res.result}, { indent = true }) end, 10000)
+                    if res.timeout then
+                        buffer = pp({timeout=true, error="Serialization of result took too long", reply_id=request_id})
+                    else
+                        buffer = res.result
+                    end
                 end
+                log("> " .. buffer)
+                buffer = buffer .. "\n"
+
+                vlc.net.send(client, buffer)
             end
-            log("> " .. buffer)
-            buffer = buffer .. "\n"
-            
-            vlc.net.send(client, buffer)
+            pending[client] = data
         end
         check_running()
         sleep(0.05)
@@ -0,0 +1,162 @@
+import asyncio
+from asyncio import IncompleteReadError
+import unittest
+
+from main import JsonBufferedProtocol
+
+
+def feed(protocol: JsonBufferedProtocol, data: bytes):
+    """Hand data to the protocol the way a transport does after a recv_into"""
+    buffer = protocol.get_buffer(len(data))
+    buffer[:len(data)] = data
+    del buffer
+    protocol.buffer_updated(len(data))
+
+
+class ReadJsonTest(unittest.IsolatedAsyncioTestCase):
+    def assert_scan_state_reset(self, protocol: JsonBufferedProtocol):
+        self.assertEqual((protocol._scanned, protocol._depth, protocol._in_string), (0, 0, False))
+
+    async def test_whole_reply(self):
+        protocol = JsonBufferedProtocol()
+        feed(protocol, b'{"reply_id": 1, "timeout": false, "result": [[1, 2], ["a", "b"]]}\n')
+        self.assertEqual(
+            await protocol.readjson(), {"reply_id": 1, "timeout": False, "result": [[1, 2], ["a", "b"]]})
+        self.assert_scan_state_reset(protocol)
+
+    async def test_two_replies_in_one_buffer(self):
+        protocol = JsonBufferedProtocol()
+        feed(protocol, b'{"reply_id": 1, "result": [1]}\n{"reply_id": 2, "result": "]"}\n')
+        self.assertEqual(await protocol.readjson(), {"reply_id": 1, "result": [1]})
+        self.assert_scan_state_reset(protocol)
+        self.assertEqual(await protocol.readjson(), {"reply_id": 2, "result": "]"})
+        self.assert_scan_state_reset(protocol)
+
+    async def test_reply_split_across_updates(self):
+        # Split inside a string, then right after a ']' so the single-reply attempt fails
+        pieces = [b'{"reply_id": 1, "result": [["a]', b'b", "c\\"d"]', b', [1, 2]]', b'}\n']
+        protocol = JsonBufferedProtocol()
+        task = asyncio.ensure_future(protocol.readjson())
+        for piece in pieces[:-1]:
+            feed(protocol, piece)
+            await asyncio.sleep(0)
+            self.assertFalse(task.done())
+        feed(protocol, pieces[-1])
+        self.assertEqual(await task, {"reply_id": 1, "result": [["a]b", 'c"d'], [1, 2]]})
+        self.assert_scan_state_reset(protocol)
+
+    async def test_split_reply_followed_by_another(self):
+        protocol = JsonBufferedProtocol()
+        task = asyncio.ensure_future(protocol.readjson())
+        feed(protocol, b'{"reply_id": 1, "result": "{[')
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        # The rest of the first reply arrives together with a whole second one
+        feed(protocol, b'"}\n{"reply_id": 2}\n')
+        self.assertEqual(await task, {"reply_id": 1, "result": "{["})
+        self.assert_scan_state_reset(protocol)
+        self.assertEqual(await protocol.readjson(), {"reply_id": 2})
+        self.assert_scan_state_reset(protocol)
+
+    async def test_eof_with_leftover_bytes(self):
+        protocol = JsonBufferedProtocol()
+        feed(protocol, b'{"reply_id": 1}\n  {"reply_id": 2, "result": [')
+        protocol.eof_received()
+        self.assertEqual(await protocol.readjson(), {"reply_id": 1})
+        with self.assertRaises(IncompleteReadError) as raised:
+            await protocol.readjson()
+        self.assertEqual(raised.exception.partial, b'{"reply_id": 2, "result": [')
+        self.assert_scan_state_reset(protocol)
+
+
+class FakeTransport:
+    def __init__(self):
+        self.calls = []
+
+    def pause_reading(self):
+        self.calls.append('pause')
+
+    def resume_reading(self):
+        self.calls.append('resume')
+
+
+class FlowControlTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.protocol = JsonBufferedProtocol(limit=16)
+        self.protocol.connection_made(self.transport)  # type: ignore[arg-type]
+
+    async def test_pauses_above_twice_the_limit_and_resumes_at_the_limit(self):
+        # Five 8 byte replies: 40 unread bytes is above 2 * 16
+        feed(self.protocol, b'{"a":1}\n' * 4)
+        self.assertEqual(self.transport.calls, [])
+        feed(self.protocol, b'{"a":1}\n')
+        self.assertEqual(self.transport.calls, ['pause'])
+
+        for _ in range(3):
+            await self.protocol.readjson()
+        # The newline after the third reply is only skipped by the next read: 17 unread bytes
+        self.assertEqual(self.transport.calls, ['pause'])
+        await self.protocol.readjson()
+        self.assertEqual(self.transport.calls, ['pause', 'resume'])
+
+    async def test_waiting_for_data_resumes_a_paused_transport(self):
+        feed(self.protocol, b'{"a": "' + b'x' * 30)
+        self.assertEqual(self.transport.calls, ['pause'])
+        task = asyncio.ensure_future(self.protocol.readjson())
+        await asyncio.sleep(0)
+        self.assertEqual(self.transport.calls, ['pause', 'resume'])
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+
+class BufferTest(unittest.IsolatedAsyncioTestCase):
+    async def test_unread_bytes_survive_growth(self):
+        protocol = JsonBufferedProtocol(limit=8192)
+        first = b'{"a": 1}\n'
+        partial = b'{"b": "' + b'y' * 7000
+        feed(protocol, first + partial)
+        self.assertEqual(await protocol.readjson(), {"a": 1})
+
+        # Not enough room left and too little consumed to compact, so the buffer grows
+        capacity = len(protocol._buffer)
+        buffer = protocol.get_buffer(-1)
+        del buffer
+        self.assertGreater(len(protocol._buffer), capacity)
+
+        feed(protocol, b'"}\n')
+        self.assertEqual(await protocol.readjson(), {"b": "y" * 7000})
+
+    async def test_compacts_once_over_half_consumed(self):
+        protocol = JsonBufferedProtocol(limit=8192)
+        first = b'{"a": "' + b'x' * 5990 + b'"}'
+        feed(protocol, first + b'{"b": [1, 2')
+        self.assertEqual(await protocol.readjson(), {"a": "x" * 5990})
+
+        # Most of the buffer is consumed, so the unread bytes move to the front instead of growing
+        capacity = len(protocol._buffer)
+        buffer = protocol.get_buffer(-1)
+        del buffer
+        self.assertEqual(len(protocol._buffer), capacity)
+        self.assertEqual(protocol._start, 0)
+        self.assertEqual(bytes(protocol._buffer[:protocol._end]), b'{"b": [1, 2')
+
+        feed(protocol, b']}')
+        self.assertEqual(await protocol.readjson(), {"b": [1, 2]})
+
+    async def test_shrinks_back_to_the_limit_once_empty(self):
+        protocol = JsonBufferedProtocol(limit=4096)
+        reply = b'{"a": "' + b'x' * 2990 + b'"}'
+        feed(protocol, reply + reply)
+        self.assertGreater(len(protocol._buffer), 4096)
+
+        await protocol.readjson()
+        # Still holding the second reply
+        self.assertGreater(len(protocol._buffer), 4096)
+        await protocol.readjson()
+        self.assertEqual(len(protocol._buffer), 4096)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from main import VLCApi
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = []
+
+    def writelines(self, data):
+        self.written.extend(data)
+
+
+class RequestWindowTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.api = VLCApi()
+        self.api.writer = FakeTransport()  # type: ignore[assignment]
+
+    def submit(self, count: int):
+        return [self.api._submit(f"return {index}") for index in range(count)]
+
+    async def test_lookup(self):
+        a, b, c = self.submit(3)
+        self.assertIs(self.api._get_request(0), a)
+        self.assertIs(self.api._get_request(1), b)
+        self.assertIs(self.api._get_request(2), c)
+
+    async def test_release_out_of_order(self):
+        a, b, c = self.submit(3)
+        self.api._release_request(2)
+        self.api._release_request(1)
+        # The head is still outstanding, so the window keeps its place
+        self.assertEqual(self.api._request_base, 0)
+        self.assertIs(self.api._get_request(0), a)
+        self.assertIsNone(self.api._get_request(1))
+        self.assertIsNone(self.api._get_request(2))
+
+        self.api._release_request(0)
+        self.assertEqual(self.api._request_base, 3)
+        self.assertEqual(len(self.api._request_slots), 0)
+
+    async def test_double_release_inside_window(self):
+        a, b, c = self.submit(3)
+        self.api._release_request(1)
+        self.api._release_request(1)
+        self.assertIs(self.api._get_request(0), a)
+        self.assertIs(self.api._get_request(2), c)
+
+    async def test_double_release_outside_window(self):
+        a, b, c = self.submit(3)
+        self.api._release_request(0)
+        self.assertEqual(self.api._request_base, 1)
+        # Used to index the deque with -1 and clear the newest request
+        self.api._release_request(0)
+        self.assertEqual(self.api._request_base, 1)
+        self.assertIs(self.api._get_request(1), b)
+        self.assertIs(self.api._get_request(2), c)
+
+    async def test_get_request_outside_window(self):
+        self.submit(3)
+        self.api._release_request(0)
+        self.assertIsNone(self.api._get_request(0))
+        self.assertIsNone(self.api._get_request(-1))
+        self.assertIsNone(self.api._get_request(3))
+        self.assertIsNone(self.api._get_request(100))
+
+    async def test_issue_request_releases_when_done(self):
+        future = self.api.issue_request("return 2+2")
+        request = self.api._get_request(0)
+        assert request is not None
+        future.set_result(request)
+        await asyncio.sleep(0)
+        self.assertIsNone(self.api._get_request(0))
+        self.assertEqual(self.api._request_base, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
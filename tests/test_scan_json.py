@@ -0,0 +1,79 @@
+import json
+import unittest
+
+from main import _scan_json
+
+
+def scan_in_pieces(data: bytes, piece: int):
+    """Feed data to _scan_json piece bytes at a time, like consecutive socket reads would"""
+    buffer = bytearray()
+    pos, depth, in_string = 0, 0, False
+    for offset in range(0, len(data), piece):
+        buffer += data[offset:offset + piece]
+        pos, depth, in_string = _scan_json(buffer, pos, len(buffer), depth, in_string)
+        if depth == 0 and pos != 0:
+            break
+    return pos, depth, in_string
+
+
+class ScanJsonTest(unittest.TestCase):
+    def test_complete_object(self):
+        data = bytearray(b'{"reply_id": 1, "result": [1, 2, {"a": null}]}')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_complete_array(self):
+        data = bytearray(b'[[1, 2], ["a", "b"]]')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_stops_after_first_object(self):
+        first = b'{"reply_id": 1}'
+        data = bytearray(first + b'\n{"reply_id": 2}')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(first), 0, False))
+
+    def test_respects_end(self):
+        data = bytearray(b'{"a": [1]}{"b": 2}')
+        self.assertEqual(_scan_json(data, 0, 5, 0, False), (5, 1, False))
+
+    def test_incomplete_object(self):
+        data = bytearray(b'{"result": [1, 2')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 2, False))
+
+    def test_incomplete_inside_string(self):
+        data = bytearray(b'{"result": "abc')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 1, True))
+
+    def test_brackets_inside_strings_are_ignored(self):
+        data = bytearray(b'{"a": "}]{[", "b": ["]"]}')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_escaped_quote_does_not_end_string(self):
+        data = bytearray(b'{"a": "say \\"}\\" please"}')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_escaped_backslash_before_quote_ends_string(self):
+        data = bytearray(b'{"a": "c:\\\\", "b": "}"}')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_backslash_at_end_resumes_at_backslash(self):
+        data = bytearray(b'{"a": "x\\')
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data) - 1, 1, True))
+
+    def test_non_ascii(self):
+        data = bytearray('{"a": "Svenska é [ü]"}'.encode('utf-8'))
+        self.assertEqual(_scan_json(data, 0, len(data), 0, False), (len(data), 0, False))
+
+    def test_resumes_at_every_split(self):
+        obj = {
+            "reply_id": 3,
+            "timeout": False,
+            "result": [[-1, 3], ["Disable", "Track 1 - [English] \\\"q\\\" {x}"]],
+        }
+        data = (json.dumps(obj, indent=4, ensure_ascii=False) + "\n").encode('utf-8')
+        length = len(data) - 1
+        for piece in range(1, len(data) + 1):
+            with self.subTest(piece=piece):
+                self.assertEqual(scan_in_pieces(data, piece), (length, 0, False))
+
+
+if __name__ == "__main__":
+    unittest.main()